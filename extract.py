@@ -1,17 +1,24 @@
 import os
-import json
+import orjson
 import csv
 import datetime
 import argparse
-from typing import List, Type, TypeVar
+import hashlib
+import mmap
+from typing import AsyncIterator, List, Optional, Tuple, Type, TypeVar
 from pydantic import BaseModel
 import asyncio
 from tqdm.asyncio import tqdm_asyncio
 import importlib
+import functools
 import llm, utils
 
 T = TypeVar('T', bound=BaseModel)
 
+# extraction and verification calls have very different latency and rate limits, so they get separate budgets
+EXTRACT_SEM = asyncio.Semaphore(int(os.getenv("EXTRACT_CONCURRENCY", 64)))
+VERIFY_SEM = asyncio.Semaphore(int(os.getenv("VERIFY_CONCURRENCY", 256)))
+
 def get_schema(schema_name: str) -> Type[BaseModel]:
     try:
         return getattr(utils, schema_name)
@@ -22,102 +29,121 @@ def get_schema(schema_name: str) -> Type[BaseModel]:
         except (ImportError, AttributeError):
             raise ValueError(f"Schema '{schema_name}' not found in utils or utils.schemas")
         
-async def verify_needle(item: dict, chunk: str, verify_prompt: str) -> bool:
+async def verify_needles(items: List[dict], chunk: str, verify_prompt: str) -> List[bool]:
     """
-    llm verification of extracted information.
+    llm verification of all the information extracted from a chunk in a single request.
 
     Args:
-    item (dict): The extracted information.
+    items (List[dict]): The extracted information.
     chunk (str): The text chunk from which the information was extracted.
     verify_prompt (str): The system prompt for verification.
 
     Returns:
-    bool: True if the information is verified, False otherwise.
+    List[bool]: One verdict per item, True if the information is verified, False otherwise.
+    items the model returns no verdict for are re-verified on their own.
     """
-    relevant_text = utils.get_relevant_text(chunk, item)
-    
+    if not items:
+        return []
+    split = utils.split_paragraphs(chunk)
+    item_blocks = []
+    for i, item in enumerate(items, start=1):
+        relevant_text = utils.get_relevant_text(chunk, item, split=split)
+        item_blocks.append(f"Item {i}:\nText:\n{relevant_text}\n\nExtracted Information:\n{orjson.dumps(item, option=orjson.OPT_INDENT_2).decode()}")
+
     messages = [
         {"role": "system", "content": verify_prompt},
-        {"role": "user", "content": f"Text:\n{relevant_text}\n\nExtracted Information:\n{json.dumps(item, indent=2)}"}
+        {"role": "user", "content": "\n\n".join(item_blocks)}
     ]
     try:
-        response = await llm.openai_client_chat_completion_request(
-            messages, 
-            model="gpt-4o-mini", 
-            temperature=0.4,
-            response_format="text",
-            max_tokens=1
-        )
-        result = response.choices[0].message.content.strip().lower()
-        if result == 'false':
-            print(f"Verification failed for: {item}")
-        return result == 'true'
+        async with VERIFY_SEM:
+            result = await llm.openai_client_structured_completion_request(
+                messages, 
+                utils.VerifyBatch, 
+                model="gpt-4o-mini", 
+                temperature=0.4
+            )
     except Exception as e:
-        print(f"Error verifying needle: {e}")
-        return False
-
-async def process_chunk(schema: Type[T], chunk: str, sys_prompt: str, verify_prompt: str = None) -> List[T]:
+        print(f"Error verifying needles: {e}")
+        return [False] * len(items)
+
+    # a refusal parses to None, treat it like a response with no verdicts
+    verdicts = {v.index: v.verified for v in (result.verdicts if result else []) if 1 <= v.index <= len(items)}
+    for i, verified in verdicts.items():
+        if not verified:
+            print(f"Verification failed for: {items[i - 1]}")
+    missing = [i for i in range(1, len(items) + 1) if i not in verdicts]
+    if missing and len(items) > 1:
+        print(f"Verification returned no verdict for {len(missing)} of {len(items)} items, re-verifying individually")
+        retried = await asyncio.gather(*(verify_needles([items[i - 1]], chunk, verify_prompt) for i in missing))
+        verdicts.update((i, verified[0]) for i, verified in zip(missing, retried))
+    return [verdicts.get(i, False) for i in range(1, len(items) + 1)]
+
+async def process_chunk(schema: Type[T], list_model: Type[BaseModel], chunk: str, sys_prompt: str, verify_prompt: str = None) -> List[Tuple[tuple, T]]:
     """
     extract a list of needles from a chunk of text using a given schema and openai structured output api.
 
     Args:
     schema (Type[T]): The Pydantic model to use for structuring the output.
+    list_model (Type[BaseModel]): The list wrapper around schema passed to the structured output api.
     chunk (str): The text chunk to process.
     sys_prompt (str): The system prompt to display to the model.
 
     Returns:
-    List[T]: A list of extracted needles.
+    List[Tuple[tuple, T]]: A list of extracted needles, each paired with its field values for deduplication.
     """
     messages = [
         {"role": "system", "content": sys_prompt},
         {"role": "user", "content": "Extract the information from the following:" "\n\n" + chunk}
     ]
     try:
-        result = await llm.openai_client_structured_completion_request(
-            messages, 
-            utils.create_list_model(schema), 
-            model="gpt-4o-2024-08-06", 
-            temperature=0.6
+        async with EXTRACT_SEM:
+            result = await llm.openai_client_structured_completion_request(
+                messages, 
+                list_model, 
+                model="gpt-4o-2024-08-06", 
+                temperature=0.6
+            )
+        extracted_items = utils.get_list_adapter(schema).validate_python(
+            [{k: utils.clean_field(v) for k, v in item.model_dump().items()} for item in result.items]
         )
-        extracted_items = [schema(**{k: utils.clean_field(v) for k, v in item.dict().items()}) for item in result.items]
-        filtered_items = [item for item in extracted_items if utils.has_sufficient_populated_fields(item, threshold=0.5)]
+        keyed_items = ((utils.field_values(item), item) for item in extracted_items)
+        filtered_items = [
+            (values, item) for values, item in keyed_items
+            if utils.has_sufficient_populated_values(values, threshold=0.5)
+        ]
         if verify_prompt:
-            verified_items = []
-            for item in filtered_items:
-                if await verify_needle(item.model_dump(), chunk, verify_prompt):
-                    verified_items.append(item)
-            return verified_items
+            verify_flags = await verify_needles([item.model_dump() for _, item in filtered_items], chunk, verify_prompt)
+            return [keyed_item for keyed_item, verified in zip(filtered_items, verify_flags) if verified]
         else:
             return filtered_items
     except Exception as e:
         print(f"Error processing chunk: {e}")
         return []
 
-async def process_chunks(schema: Type[T], chunks: List[str], sys_prompt: str, verify_prompt: str = None) -> List[T]:
-    semaphore = asyncio.Semaphore(300)
-    async def sem_task(chunk: str):
-        async with semaphore:
-            return await process_chunk(schema, chunk, sys_prompt, verify_prompt)
-    tasks = [sem_task(chunk) for chunk in chunks]
-    results = await tqdm_asyncio.gather(*tasks, desc="Extracting Needles")
-    return [item for result in results for item in result]
-
-async def extract_multi_needle(schema: Type[T], haystack: str, example_needles: List[str] = None, verify: bool = False) -> List[T]:
+async def process_chunks(schema: Type[T], list_model: Type[BaseModel], chunks: List[str], sys_prompt: str, verify_prompt: str = None) -> AsyncIterator[List[Tuple[tuple, T]]]:
     """
-    Extracts and structures information from a large text corpus based on a schema.
+    process chunks concurrently, yielding each chunk's needles as soon as it completes.
+    identical chunks are only sent once, their needles would be deduplicated downstream anyway.
+    """
+    unique_chunks = {}
+    for chunk in chunks:
+        unique_chunks.setdefault(hashlib.blake2b(chunk.encode(), digest_size=16).digest(), chunk)
+    tasks = [process_chunk(schema, list_model, chunk, sys_prompt, verify_prompt) for chunk in unique_chunks.values()]
+    for result in tqdm_asyncio.as_completed(tasks, desc="Extracting Needles"):
+        yield await result
+
+@functools.lru_cache(maxsize=128)
+def build_prompts(schema: Type[BaseModel], example_needles: Optional[Tuple[str, ...]] = None) -> Tuple[str, str]:
+    """
+    build the extraction and verification system prompts for a schema.
 
     Args:
-    schema (Type[T]): The Pydantic model defining the structure of the needle to be extracted.
-    haystack (str): The large text corpus to search through (haystack).
-    example_needles (List[str]): A list of example sentences (needles).
+    schema (Type[BaseModel]): The Pydantic model defining the structure of the needle to be extracted.
+    example_needles (Tuple[str, ...], optional): Example sentences (needles) to include in the extraction prompt.
 
     Returns:
-    List[T]: A list of unique extracted needles conforming to the provided schema.
+    Tuple[str, str]: The extraction system prompt and the verification system prompt.
     """
-    unique_needles = set()
-    extracted_needles = []
-    paragraphs = haystack.split('\n\n')
-    chunks = utils.chunk_text(paragraphs)
     model_name, fields_description = utils.schema_to_descriptive_string(schema)
     fields_str = "\n".join([f"{field} {description}" for field, description in fields_description.items()])
     if example_needles:
@@ -132,31 +158,51 @@ async def extract_multi_needle(schema: Type[T], haystack: str, example_needles:
             model_name=model_name,
             fields=fields_str
         )
-    if verify:
-        verify_prompt = utils.veryify_needle_sys.format(
-            model_name=model_name,
-            fields=fields_str
-        )
-        needles = await process_chunks(schema, chunks, sys_prompt, verify_prompt)
-    else:
-        needles = await process_chunks(schema, chunks, sys_prompt)
+    verify_prompt = utils.veryify_needle_batch_sys.format(
+        model_name=model_name,
+        fields=fields_str
+    )
+    return sys_prompt, verify_prompt
+
+async def extract_multi_needle(schema: Type[T], haystack: str, example_needles: List[str] = None, verify: bool = False) -> List[T]:
+    """
+    Extracts and structures information from a large text corpus based on a schema.
+
+    Args:
+    schema (Type[T]): The Pydantic model defining the structure of the needle to be extracted.
+    haystack (str): The large text corpus to search through (haystack).
+    example_needles (List[str]): A list of example sentences (needles).
+
+    Returns:
+    List[T]: A list of unique extracted needles conforming to the provided schema.
+    """
+    unique_needles = set()
+    extracted_needles = []
+    paragraphs = haystack.split('\n\n')
+    chunks = utils.chunk_text(paragraphs)
+    list_model = utils.create_list_model(schema)
+    sys_prompt, verify_prompt = build_prompts(schema, tuple(example_needles) if example_needles else None)
+    if not verify:
+        verify_prompt = None
     
-    for needle in needles:
-            needle_tuple = tuple(getattr(needle, field) for field in needle.model_fields)
-            if needle_tuple not in unique_needles:
-                unique_needles.add(needle_tuple)
+    async for needles in process_chunks(schema, list_model, chunks, sys_prompt, verify_prompt):
+        for needle_key, needle in needles:
+            if needle_key not in unique_needles:
+                unique_needles.add(needle_key)
                 extracted_needles.append(needle)
     
     return extracted_needles
 
 async def main(text_file: str, schema_name: str, use_examples: bool, example_needles: List[str], remove_dialogue: bool, verify: bool):
-    with open(text_file, 'r') as f:
-        text = f.read()
-
-    if remove_dialogue:
-        filtered_text = utils.remove_dialogue(text)
+    if remove_dialogue and os.path.getsize(text_file) > 0:
+        # strip dialogue straight from the mapped file so only the filtered text is ever decoded,
+        # newlines are normalised to match what text mode does in the other branch
+        with open(text_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            filtered = utils.remove_dialogue_bytes(mm)
+        filtered_text = filtered.replace(b'\r\n', b'\n').replace(b'\r', b'\n').decode('utf-8')
     else:
-        filtered_text = text
+        with open(text_file, 'r', encoding='utf-8') as f:
+            filtered_text = f.read()
 
     schema = get_schema(schema_name)
 
@@ -169,24 +215,24 @@ async def main(text_file: str, schema_name: str, use_examples: bool, example_nee
     os.makedirs(data_dir, exist_ok=True)
     
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    rows = [needle.model_dump() for needle in extracted_needles]
     save_json = False
     if save_json:
         # save extracted needles to a json file
         filename = f"extracted_needles_{schema_name}_{timestamp}.json"
         file_path = os.path.join(data_dir, filename)
-        with open(file_path, 'w') as f:
-            json.dump([needle.model_dump() for needle in extracted_needles], f, indent=2)
+        with open(file_path, 'wb') as f:
+            f.write(orjson.dumps(rows, option=orjson.OPT_INDENT_2))
         print(f"Extracted needles saved to: {file_path}")
     # save extracted needles to a csv file
     csv_filename = f"extracted_needles_{schema_name}_{timestamp}.csv"
     csv_file_path = os.path.join(data_dir, csv_filename)
-    with open(csv_file_path, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=extracted_needles[0].model_fields.keys())
+    with open(csv_file_path, 'w', newline='', buffering=1 << 20) as f:
+        writer = csv.DictWriter(f, fieldnames=list(extracted_needles[0].model_fields))
         writer.writeheader()
-        for needle in extracted_needles:
-            writer.writerow(needle.model_dump())
+        writer.writerows(rows)
     print("\nSample of extracted needles:")
-    print(json.dumps([needle.model_dump() for needle in extracted_needles[:3]], indent=2))
+    print(orjson.dumps(rows[:3], option=orjson.OPT_INDENT_2).decode())
     print(f"Extracted needles saved to: {csv_file_path}")
     print(f"Number of needles extracted: {len(extracted_needles)}")
     
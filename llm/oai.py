@@ -1,12 +1,26 @@
 from tenacity import retry, retry_if_exception_type, wait_random_exponential, stop_after_attempt
 import asyncio
+import hashlib
+import json
+import os
+import diskcache
 import openai
 from openai import AsyncOpenAI
+from aiolimiter import AsyncLimiter
 from typing import TypeVar, List, Type
-from pydantic import BaseModel
-from utils import ListModel
+from pydantic import BaseModel, ValidationError
 client = AsyncOpenAI()
 
+# smooth request arrival to the api tier limit so tenacity only has to handle real failures
+_STRUCT_LIMITER = AsyncLimiter(max_rate=500, time_period=60)
+
+# opt-in on-disk cache of parsed structured responses for repeat dev runs
+_CACHE = diskcache.Cache('./.llm_cache') if os.getenv("LLM_CACHE") == "1" else None
+
+def _cache_key(messages: List[dict], response_model: Type[BaseModel], model: str, temperature: float) -> str:
+    payload = json.dumps([model, messages, temperature, response_model.__name__], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
 
 T = TypeVar('T', bound=BaseModel)
 
@@ -18,18 +32,33 @@ T = TypeVar('T', bound=BaseModel)
 )
 async def openai_client_structured_completion_request(
     messages: List[dict], 
-    response_model: Type[ListModel],
+    response_model: Type[T],
     model: str = "gpt-4o-2024-08-06",
     temperature: float = 0.4
-) -> ListModel:
+) -> T:
+    if _CACHE is not None:
+        key = _cache_key(messages, response_model, model, temperature)
+        cached = _CACHE.get(key)
+        if cached is not None:
+            try:
+                return response_model.model_validate_json(cached)
+            except ValidationError:
+                # stale entry from an older version of the schema, evict it and refetch
+                print(f"Discarding cached {response_model.__name__} response that no longer validates")
+                _CACHE.delete(key)
     try:
-        completion = await client.beta.chat.completions.parse(
-            model=model,
-            messages=messages,
-            response_format=response_model,
-            temperature=temperature
-        )
-        return completion.choices[0].message.parsed
+        async with _STRUCT_LIMITER:
+            completion = await client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_model,
+                temperature=temperature
+            )
+        parsed = completion.choices[0].message.parsed
+        # refusals parse to None, don't cache them
+        if _CACHE is not None and parsed is not None:
+            _CACHE[key] = parsed.model_dump_json()
+        return parsed
     except openai.APIError as e:
         print(f"OpenAI structured API Error: {e}")
         raise
@@ -38,30 +67,4 @@ async def openai_client_structured_completion_request(
         raise
     except Exception as e:
         print(f"Error in OpenAI structured API call: {e}")
-        raise
-
-@retry(
-    wait=wait_random_exponential(multiplier=1, min=4, max=60),
-    retry=retry_if_exception_type((Exception)),
-    stop=stop_after_attempt(5),
-    before_sleep=lambda retry_state: print(f"Retrying attempt {retry_state.attempt_number} for OAI completion request...")
-)
-async def openai_client_chat_completion_request(messages, model="gpt-4o", temperature=0.4, response_format="text", max_tokens=1024):
-    try:
-        response = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            response_format={ "type": response_format },
-            temperature=temperature,
-            max_completion_tokens=max_tokens
-        )
-        return response
-    except openai.APIError as e:
-        print(f"OpenAI API Error: {e}")
-        raise
-    except asyncio.TimeoutError as e:
-        print(f"TimeoutError in OpenAI API call: {e}")
-        raise
-    except Exception as e:
-        print(f"Error in OpenAI API call: {e}")
         raise
\ No newline at end of file
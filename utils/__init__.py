@@ -1,14 +1,21 @@
 from .schemas import TechCompany
-from .prompts import struc_find_needle_sys, struc_find_needle_sys_no_ex, veryify_needle_sys
+from .prompts import struc_find_needle_sys, struc_find_needle_sys_no_ex, veryify_needle_batch_sys
 from .tools import (
     count_tokens,
+    count_tokens_batch,
     remove_dialogue,
+    remove_dialogue_bytes,
     chunk_text,
     schema_to_descriptive_string,
-    ListModel,
+    ItemVerdict,
+    VerifyBatch,
     create_list_model,
+    get_list_adapter,
     clean_field,
+    field_values,
     has_any_populated_field,
     has_sufficient_populated_fields,
+    has_sufficient_populated_values,
     get_relevant_text,
+    split_paragraphs,
 )
\ No newline at end of file
@@ -27,14 +27,15 @@ Fields:
 - **If there is no hidden information that follows the {model_name} model in the text, you must output an empty list ([]).**"""
 
 
-veryify_needle_sys = """You are a data validation expert. You will be given a passage of text and extracted information from that text. The extracted information must be be out of place within the text. You must determine whether the extracted information is correct based on the {model_name} Model, given below:
+veryify_needle_batch_sys = """You are a data validation expert. You will be given a numbered list of items, each with a passage of text and information extracted from that text. The extracted information must be out of place within the text. For each item, you must determine whether the extracted information is correct based on the {model_name} Model, given below:
 
 Model: {model_name}
 Fields: 
 {fields}
 
 ## Output:
-- **If the extracted information is correct, you must output `True`.** 
-- **If you are unsure, you must output `True`.**
-- **If the extracted information is incorrect, you must output `False`.**
+- **You must output exactly one verdict per item, each with the number of the item it refers to.**
+- **If the extracted information is correct, the verdict must be `true`.** 
+- **If you are unsure, the verdict must be `true`.**
+- **If the extracted information is incorrect, the verdict must be `false`.**
 """
\ No newline at end of file
@@ -1,47 +1,73 @@
 import re
-from typing import Type, Tuple, Dict, List, TypeVar, Generic, get_type_hints
-from pydantic import BaseModel, create_model
+import functools
+import types
+from operator import attrgetter
+from typing import Type, Tuple, List, Mapping, Optional, TypeVar, get_type_hints
+from pydantic import BaseModel, TypeAdapter, create_model
 import tiktoken
 
+@functools.lru_cache(maxsize=8)
+def _get_encoding(encoding_name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
 def count_tokens(text: str, encoding_name: str = "o200k_base") -> int:
     """
     count the number of tokens in the given text using the specified encoding.
     """
-    encoding = tiktoken.get_encoding(encoding_name)
+    encoding = _get_encoding(encoding_name)
     num_tokens = len(encoding.encode(text))
     return num_tokens
 
+def count_tokens_batch(texts: List[str], encoding_name: str = "o200k_base") -> List[int]:
+    """
+    count the number of tokens in each of the given texts in a single batched call.
+    """
+    encoding = _get_encoding(encoding_name)
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+_DIALOGUE_RE = re.compile(r'[“"](.+?)[”"]', re.DOTALL)
+
 def remove_dialogue(text: str) -> str:
     """
     remove any dialogue from the text, including quotation marks.
     """
-    return re.sub(r'[“"](.+?)[”"]', '', text, flags=re.DOTALL)
+    return _DIALOGUE_RE.sub('', text)
+
+# bytes equivalent of _DIALOGUE_RE for utf-8 input, the curly quotes are multi-byte so they can't go in a character class
+_DIALOGUE_RE_B = re.compile('(?:“|")(.+?)(?:”|")'.encode(), re.DOTALL)
+
+def remove_dialogue_bytes(data) -> bytes:
+    """
+    remove any dialogue from utf-8 encoded text (bytes or any buffer, e.g. an mmap), including quotation marks.
+    """
+    return _DIALOGUE_RE_B.sub(b'', data)
 
 def chunk_text(paragraphs: list, max_tokens: int = 32000) -> list:
     """
     split the paragraphs into chunks of at most max_tokens tokens.
     """
     chunks = []
-    current_chunk = ''
+    buf = []
     curent_tokens = 0
-    for paragraph in paragraphs:
-        paragraph.strip()
-        paragraph_tokens = count_tokens(paragraph)
+    token_counts = count_tokens_batch([paragraph.strip() for paragraph in paragraphs])
+    for paragraph, paragraph_tokens in zip(paragraphs, token_counts):
         if curent_tokens + paragraph_tokens > max_tokens:
-            chunks.append(current_chunk)
-            current_chunk = ''
+            chunks.append(''.join(buf))
+            buf.clear()
             curent_tokens = 0
-        current_chunk += paragraph + '\n\n'
+        buf.extend((paragraph, '\n\n'))
         curent_tokens += paragraph_tokens
 
-    if current_chunk:
-        chunks.append(current_chunk)
+    if buf:
+        chunks.append(''.join(buf))
 
     return chunks
 
-def schema_to_descriptive_string(model: Type[BaseModel]) -> Tuple[str, Dict[str, str]]:
+@functools.lru_cache(maxsize=128)
+def schema_to_descriptive_string(model: Type[BaseModel]) -> Tuple[str, Mapping[str, str]]:
     """
     convert a Pydantic model to a descriptive string.
+    the result is cached, so the field descriptions are returned as a read-only mapping.
     """
     model_name = model.__name__
     fields_description = {}
@@ -65,20 +91,18 @@ def schema_to_descriptive_string(model: Type[BaseModel]) -> Tuple[str, Dict[str,
         field_description = field.description or "No description provided"
         fields_description[field_name] = f"({type_name}): {field_description}"
     
-    return model_name, fields_description
+    return model_name, types.MappingProxyType(fields_description)
 
 T = TypeVar('T', bound=BaseModel)
 
-class ListModel(Generic[T]):
-    __root__: List[T]
+class ItemVerdict(BaseModel):
+    index: int
+    verified: bool
 
-    def __init__(self, items: List[T]):
-        self.__root__ = items
-
-    @property
-    def items(self) -> List[T]:
-        return self.__root__
+class VerifyBatch(BaseModel):
+    verdicts: List[ItemVerdict]
 
+@functools.lru_cache(maxsize=128)
 def create_list_model(item_model: Type[T]) -> Type[BaseModel]:
     return create_model(
         f"{item_model.__name__}List",
@@ -86,21 +110,53 @@ def create_list_model(item_model: Type[T]) -> Type[BaseModel]:
         __base__=BaseModel
     )
 
+@functools.lru_cache(maxsize=128)
+def get_list_adapter(item_model: Type[T]) -> TypeAdapter:
+    """
+    get a (cached) TypeAdapter that validates a list of item_model in a single call.
+    """
+    return TypeAdapter(List[item_model])
+
 def clean_field(value):
     if isinstance(value, str):
         value = value.strip()
         return None if value.lower() == "null" or value == "" else value
     return value if value is not None else None
 
+@functools.lru_cache(maxsize=128)
+def _field_getter(model: Type[BaseModel]):
+    # one attrgetter per model class fetches every field value in a single call
+    fields = tuple(model.model_fields)
+    if len(fields) > 1:
+        return attrgetter(*fields)
+    if fields:
+        return lambda obj: (getattr(obj, fields[0]),)
+    return lambda obj: ()
+
+def field_values(obj) -> tuple:
+    """
+    get the values of all the model's fields as a tuple, in field order.
+    """
+    return _field_getter(type(obj))(obj)
+
 def has_any_populated_field(obj):
-    return any(clean_field(getattr(obj, field)) is not None for field in obj.__fields__)
+    return any(clean_field(value) is not None for value in field_values(obj))
+
+def has_sufficient_populated_values(values: tuple, threshold=0.5):
+    populated_fields = sum(clean_field(value) is not None for value in values)
+    return populated_fields >= threshold * len(values)
 
 def has_sufficient_populated_fields(obj, threshold=0.5):
-    total_fields = len(obj.__fields__)
-    populated_fields = sum(1 for field in obj.__fields__ if clean_field(getattr(obj, field)) is not None)
-    return populated_fields / total_fields >= threshold
+    return has_sufficient_populated_values(field_values(obj), threshold)
 
-def get_relevant_text(chunk: str, item: dict, context_paragraphs: int = 3) -> str:
+def split_paragraphs(chunk: str) -> Tuple[List[str], List[str]]:
+    """
+    split the chunk into stripped paragraphs and their casefolded copies, for reuse across get_relevant_text calls.
+    """
+    paragraphs = [p.strip() for p in chunk.split('\n\n') if p.strip()]
+    return paragraphs, [p.casefold() for p in paragraphs]
+
+def get_relevant_text(chunk: str, item: dict, context_paragraphs: int = 3, split: Optional[Tuple[List[str], List[str]]] = None) -> str:
     """
     truncate the chunk around the item to provide context.
 
@@ -108,20 +164,20 @@ def get_relevant_text(chunk: str, item: dict, context_paragraphs: int = 3) -> st
     chunk (str): The text chunk.
     item (dict): The extracted information.
     context_paragraphs (int): The number of paragraphs to include before and after the matched text.
+    split (Tuple[List[str], List[str]], optional): The chunk already split by split_paragraphs.
 
     Returns:
     str: The relevant text from the chunk.
     """
-    paragraphs = [p.strip() for p in chunk.split('\n\n') if p.strip()]
+    paragraphs, lowered = split if split is not None else split_paragraphs(chunk)
     relevant_texts = set()
 
     for value in item.values():
         if value:
-            escaped_value = re.escape(str(value))
-            pattern = re.compile(f".*{escaped_value}.*", re.IGNORECASE | re.DOTALL)
-            
-            for i, paragraph in enumerate(paragraphs):
-                if pattern.search(paragraph):
+            needle = str(value).casefold()
+
+            for i, paragraph in enumerate(lowered):
+                if needle in paragraph:
                     start = max(0, i - context_paragraphs)
                     end = min(len(paragraphs), i + context_paragraphs + 1)
                     # ensure the context is at least 2 * context_paragraphs + 1 paragraphs